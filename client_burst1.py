@@ -8,12 +8,14 @@
 #
 # What it does: This version blasts UDP packets in bursts at the server, with N
 # packets in each burst, each burst sent as fast as possible, and a T second
-# delay between the end of one burst and the beginning of the next.
-#   state 0. Client waits for data to be available to send. If the seqno is a
-#           multiple of N, this is the start of a burst, so go to state 1, else
-#           go to state 2.
-#   state 1. Wait T seconds, to leave a gap between bursts.
-#   state 2. Sends one UDP packet. Don't wait for ack, just go back to state 0.
+# delay between the end of one burst and the beginning of the next. For each
+# burst, the client:
+#   1. Waits for data to be available for the next N packets. If none, then exit.
+#   2. Unless this is the first burst, waits until T seconds after the previous
+#      burst was sent, to leave a gap between bursts.
+#   3. Sends all the UDP packets of the burst at once (using UDP segmentation
+#      offload or sendmmsg(), on Linux). Don't wait for acks, just go back to
+#      step 1.
 # A 4-byte sequence number is included in each packet, so the server can detect
 # duplicates, detect missing packets, and sort any mis-ordered packets back into
 # the correct order. A 4-byte "magic" integer (0xBAADF00D) is also included with
@@ -30,12 +32,28 @@
 # packets per burst, and T=0.120 seconds (or 120 ms) between the end of one
 # burst and the beginning of the next.
 
+import os
 import socket
 import sys
 import time
-import struct
 import datasource
+import sendbatch
 import trace
+from packet import HDR
+
+# sleep until time.monotonic() reaches the specified target_time. If the
+# target_time has already passed, this function does nothing. If timer is a
+# timerfd (python 3.13 and above, on Linux), the kernel wakes us at exactly the
+# target time, otherwise we fall back to time.sleep() for the remaining time.
+def sleep_until(timer, target_time):
+    duration = target_time - time.monotonic()
+    if duration <= 0:
+        return
+    if timer is not None:
+        os.timerfd_settime(timer, flags=os.TFD_TIMER_ABSTIME, initial=target_time)
+        os.read(timer, 8)
+    else:
+        time.sleep(duration)
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -46,61 +64,102 @@ verbose = 3
 tracefile = "client_burst1_packets.csv"
 # tracefile = None # This will disable writing a trace file for the client
 
+# setting prefetch = True fetches all the data before starting, so getting the
+# data for each packet is just a list lookup (this needs enough memory to hold
+# all the data at once, about 260 MB)
+prefetch = True
+
+# size of the socket's kernel send and receive buffers (see sendbatch.py)
+sockbuf_size = 8 << 20
+
 
 def main(host, port, n, t):
     print("Sending UDP packets to %s:%d with burst size N=%d and T=%f s between bursts" % (host, port, n, t))
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # Makes a UDP socket!
+    s.connect((host, port)) # all our packets go to the server, so connect to it
+    sendbatch.set_socket_buffers(s, sockbuf_size)
 
     trace.init(tracefile,
             "Log of all packets sent and ACKs received by client", 
             "SeqNo", "TimeSent", "AckNo", "timeACKed")
 
-    start = time.time()
+    # get all the data up front, if we can, with None marking the end of it
+    bodies = datasource.prefetch_all() if prefetch else None
+    if bodies is not None:
+        bodies.append(None)
+        get_body = bodies.__getitem__
+    else:
+        get_body = datasource.wait_for_data
+
+    start = time.monotonic_ns() # all times are integer nanoseconds from here
 
     magic = 0xBAADCAFE # a value to be included in every data packet
     seqno = 0 # sequence number for the next data packet to be sent
-    hdr = None # header for the next data packet to be sent
-    body = None # data to be sent in the next data packet to be sent
-    have_more_data = True # keep track of whether we have more data to send
-    burst = -1 # current burst number
-    state = 0 # the current state for our protocol
-
-    while have_more_data:
-        if state == 0: #  wait for data to be available to send
-            body = datasource.wait_for_data(seqno)
-            if body == None: have_more_data = False
-            elif seqno % n == 0: state = 1 # go to state 1
-            else: state = 2 # go to state 2
-        
-        elif state == 1: # wait T seconds for the gap between bursts
-            time.sleep(t)
-            state = 2
-
-        elif state == 2: # send one data packet
-            # make a header, create a packet, and send it
-            hdr = bytearray(struct.pack(">II", magic, seqno))
-            pkt = hdr + body
-            tSend = time.time()
-            s.sendto(pkt, (host, port))
+    stride = HDR.size + datasource.packetSize # space for each packet in the batch
+    batch = sendbatch.SendBatch(s, None, n, stride) # one burst of packets
+    sendbuf = batch.buf
+    sendview = batch.view
+    next_burst = 0 # monotonic time at which the next burst may start
+    timer = None # timerfd used by sleep_until(), if available
+    if hasattr(os, "timerfd_create"):
+        timer = os.timerfd_create(time.CLOCK_MONOTONIC)
+
+    # look up these methods once, rather than on every trip through the loop
+    send_batch = batch.send
+    set_length = batch.set_length
+    lengths = batch.lengths
+    now = time.monotonic_ns
+    trace_write = trace.write
+    pack_hdr = HDR.pack_into
+    hdrsize = HDR.size
+
+    while True:
+        # get the data for up to N packets, and fill in each packet of the
+        # burst with its header and body
+        count = 0
+        while count < n:
+            body = get_body(seqno + count)
+            if body is None:
+                break
+            offset = count * stride
+            pack_hdr(sendbuf, offset, magic, seqno + count)
+            pktlen = hdrsize + len(body)
+            sendview[offset + hdrsize : offset + pktlen] = body
+            if pktlen != lengths[count]: # almost always the same as last time
+                set_length(count, pktlen)
+            count += 1
+        if count == 0:
+            break
 
-            # print stuff
-            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
-                print("Sent packet with seqno %d" % (seqno))
+        # wait until T seconds after the end of the previous burst
+        if seqno:
+            sleep_until(timer, next_burst)
 
+        # send the whole burst at once
+        tSend = now()
+        send_batch(count)
+        tSent = (tSend - start) * 1e-9
+
+        # the gap starts as soon as the last packet of a burst is sent, so the
+        # time spent fetching data and writing the trace counts towards it
+        next_burst = time.monotonic() + t
+
+        for i in range(seqno, seqno + count):
             # write info about the packet (but without the ACK) to the log file
-            trace.write(seqno, tSend - start, 0, 0)
+            trace_write(i, tSent, 0, 0)
 
-            # prepare for the next packet
-            seqno += 1
+            # print stuff
+            if verbose and (verbose >= 3 or i < 5 or i % 1000 == 0):
+                print("Sent packet with seqno %d" % (i))
 
-            state = 0 # go back to state 0
+        # prepare for the next burst
+        seqno += count
 
-        else:
-            print(f"OOPS! Should never be in state {state}")
-            break
+    if timer is not None:
+        os.close(timer)
 
-    end = time.time()
-    elapsed = end - start
+    end = time.monotonic_ns()
+    elapsed = (end - start) * 1e-9
     print("Finished sending all packets!")
     print("Elapsed time: %0.4f s" % (elapsed))
     trace.close()
@@ -33,9 +33,9 @@
 import socket
 import sys
 import time
-import struct
 import datasource
 import trace
+from packet import HDR
 
 # sleep until the specified target_time. If the target_time has already passed,
 # this function does nothing. Examples:
@@ -88,13 +88,13 @@ def main(host, port, n, t):
 
         elif state == 2: # send one data packet
             # make a header, create a packet, and send it
-            hdr = bytearray(struct.pack(">II", magic, seqno))
+            hdr = HDR.pack(magic, seqno)
             pkt = hdr + body
             tSend = time.time()
             s.sendto(pkt, (host, port))
 
             # print stuff
-            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
+            if verbose and (verbose >= 3 or seqno < 5 or seqno % 1000 == 0):
                 print("Sent packet with seqno %d" % (seqno))
 
             # write info about the packet (but without the ACK) to the log file
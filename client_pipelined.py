@@ -37,9 +37,9 @@
 import socket
 import sys
 import time
-import struct
 import datasource
 import trace
+from packet import HDR
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -81,13 +81,13 @@ def main(host, port, n, t):
         
         elif state == 1: # send one data packet
             # make a header, create a packet, and send it
-            hdr = bytearray(struct.pack(">II", magic, seqno))
+            hdr = HDR.pack(magic, seqno)
             pkt = hdr + body
             tSend = time.time()
             s.sendto(pkt, (host, port))
 
             # print stuff
-            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
+            if verbose and (verbose >= 3 or seqno < 5 or seqno % 1000 == 0):
                 print("Sent packet with seqno %d" % (seqno))
 
             # write info about the packet (but without the ACK) to the log file
@@ -109,8 +109,8 @@ def main(host, port, n, t):
                 (ack, addr) = s.recvfrom(100)
                 tRecv = time.time()
                 # unpack integers from the ACK packet, then print some messages
-                (magack, ackno) = struct.unpack(">II", ack)
-                if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0 or ackno != desired_ackno):
+                (magack, ackno) = HDR.unpack(ack)
+                if verbose and (verbose >= 3 or seqno < 5 or seqno % 1000 == 0 or ackno != desired_ackno):
                     print("Got ack with seqno %d while waiting for %d" % (ackno, desired_ackno))
                 # write info about the ACK to the log file
                 trace.write(0, 0, ackno, tRecv - start)
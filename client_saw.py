@@ -7,9 +7,9 @@
 # Stop-and-wait client for a simple and slightly-reliable protocol on top of UDP. 
 #
 # What it does: This implements the stop-and-wait protocol, mostly:
-#   state 0. Client waits for data to be available to send. If none, then exit.
-#   state 1. Client sends one UDP packet. The server will respond with an ACK.
-#   state 2. Client waits for one ACK, then go back to state 0.
+#   1. Client waits for data to be available to send. If none, then exit.
+#   2. Client sends one UDP packet. The server will respond with an ACK.
+#   3. Client waits for one ACK, then go back to step 1.
 # A 4-byte sequence number is included in each packet, so the server can detect
 # duplicates, detect missing packets, and sort any mis-ordered packets back into
 # the correct order. A 4-byte "magic" integer (0xBAADCAFE) is also included with
@@ -18,7 +18,7 @@
 #
 # What it doesn't do: There are no NACKs or timeouts, so if any data packet is
 # lost, or any ACK packet is lost, the protocol will deadlock, simply freezing
-# in step 2 forever. All ACK packets are treated identically (any numbers in
+# in step 3 forever. All ACK packets are treated identically (any numbers in
 # them are completely ignored), so if data packets or ACK packets get duplicated
 # in the network, things will probably go haywire.
 #
@@ -29,9 +29,9 @@
 import socket
 import sys
 import time
-import struct
 import datasource
 import trace
+from packet import HDR
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -42,67 +42,83 @@ verbose = 3
 tracefile = "client_saw_packets.csv"
 # tracefile = None # This will disable writing a trace file for the client
 
+# setting prefetch = True fetches all the data before starting, so getting the
+# data for each packet is just a list lookup (this needs enough memory to hold
+# all the data at once, about 260 MB)
+prefetch = True
+
 
 def main(host, port):
     print("Sending UDP packets to %s:%d" % (host, port))
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # Makes a UDP socket!
+    s.connect((host, port)) # all our packets go to the server, so connect to it
 
     trace.init(tracefile,
             "Log of all packets sent and ACKs received by client", 
             "SeqNo", "TimeSent", "AckNo", "timeACKed")
 
-    start = time.time()
+    # get all the data up front, if we can, with None marking the end of it
+    bodies = datasource.prefetch_all() if prefetch else None
+    if bodies is not None:
+        bodies.append(None)
+        get_body = bodies.__getitem__
+    else:
+        get_body = datasource.wait_for_data
+
+    start = time.monotonic_ns() # all times are integer nanoseconds from here
 
     magic = 0xBAADCAFE # a value to be included in every data packet
     seqno = 0 # sequence number for the next data packet to be sent
-    hdr = None # header for the next data packet to be sent
-    body = None # data to be sent in the next data packet to be sent
-    have_more_data = True # keep track of whether we have more data to send
-    state = 0 # the current state for our protocol
-
-    while have_more_data:
-        if state == 0: #  wait for data to be available to send
-            body = datasource.wait_for_data(seqno)
-            if body == None: have_more_data = False
-            else: state = 1 # go to state 1
-
-        elif state == 1: # send one data packet
-            # make a header, create a packet, and send it
-            hdr = bytearray(struct.pack(">II", magic, seqno))
-            pkt = hdr + body
-            tSend = time.time()
-            s.sendto(pkt, (host, port))
-
-            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
-                print("Sent packet with seqno %d" % (seqno))
-
-            state = 2 # go to state 2
-
-        elif state == 2: # wait for one ACK packet, increment seqno, and print some stuff
-            # wait for an ACK
-            (ack, addr) = s.recvfrom(100)
-            tRecv = time.time()
-
-            # unpack integers from the ACK packet, then print some messages
-            (magack, ackno) = struct.unpack(">II", ack)
-            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
-                print("Got ack with seqno %d" % (ackno))
-
-            # write info about the packet and the ACK to the log file
-            trace.write(seqno, tSend - start, ackno, tRecv - start)
-
-            # prepare for the next packet
-            seqno += 1
-
-            state = 0 # go back to state 0
-
-        else:
-            print(f"OOPS! Should never be in state {state}")
+    sendbuf = bytearray(HDR.size + datasource.packetSize) # reused for every packet
+    sendview = memoryview(sendbuf)
+
+    # look up these methods once, rather than on every trip through the loop
+    send = s.send
+    recv = s.recv
+    unpack_hdr = HDR.unpack_from
+    now = time.monotonic_ns
+    trace_write = trace.write
+    pack_hdr = HDR.pack_into
+    hdrsize = HDR.size
+
+    while True:
+        # get the data to send, if there is any left
+        body = get_body(seqno)
+        if body is None:
             break
 
-
-    end = time.time()
-    elapsed = end - start
+        # fill in the header and body of the send buffer, then send it
+        pack_hdr(sendbuf, 0, magic, seqno)
+        pktlen = hdrsize + len(body)
+        sendview[hdrsize:pktlen] = body
+        tSend = now()
+        send(sendview[:pktlen])
+
+        # wait for an ACK (or an ICMP error, if nothing is listening)
+        try:
+            ack = recv(100)
+        except ConnectionRefusedError:
+            print("Oops, packet with seqno %d was refused, is the server running at %s:%d?" % (seqno, host, port))
+            trace.close()
+            sys.exit(1)
+        tRecv = now()
+
+        # unpack integers from the ACK packet
+        (magack, ackno) = unpack_hdr(ack)
+
+        # write info about the packet and the ACK to the log file
+        trace_write(seqno, (tSend - start) * 1e-9, ackno, (tRecv - start) * 1e-9)
+
+        # print stuff
+        if verbose and (verbose >= 3 or seqno < 5 or seqno % 1000 == 0):
+            print("Sent packet with seqno %d" % (seqno))
+            print("Got ack with seqno %d" % (ackno))
+
+        # prepare for the next packet
+        seqno += 1
+
+    end = time.monotonic_ns()
+    elapsed = (end - start) * 1e-9
     print("Finished sending all packets!")
     print("Elapsed time: %0.4f s" % (elapsed))
     trace.close()
@@ -32,12 +32,17 @@
 # This will send data to a server at IP address 1.2.3.4 port 6000, using
 # pipeline with N=100 outstanding packets and 0.030 second (30 ms) timeout.
 
+import array
+import atexit
+import collections
+import selectors
 import socket
 import sys
 import time
-import struct
 import datasource
+import sendbatch
 import trace
+from packet import HDR
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -48,6 +53,17 @@ verbose = 0
 tracefile = "client_tahoe_packets.csv"
 # tracefile = None # This will disable writing a trace file for the client
 
+# size of the socket's kernel send and receive buffers (see sendbatch.py)
+sockbuf_size = 8 << 20
+
+cwndfile = "client_tahoe_cwnd.csv"
+# cwndfile = None # This will disable writing the congestion window log
+
+# setting precompute = True builds every packet before starting, so sending a
+# packet doesn't have to fetch data or make a header (this needs enough memory
+# to hold all the data at once, about 260 MB)
+precompute = True
+
 def estimated_rtt_calc(sample_rtt, estimated_rtt) -> float:
     a = 0.125
     return a * sample_rtt + (1 - a) * estimated_rtt
@@ -57,150 +73,268 @@ def dev_rtt_calc(sample_rtt, estimated_rtt, dev_rtt) -> float:
     return b * abs(sample_rtt - estimated_rtt) + (1 - b) * dev_rtt
 
 
+# Build every packet up front, with packet i at byte i*stride of one big buffer.
+# Returns None if that isn't possible, because the datasource doesn't say how
+# many packets there are, or because they aren't all the same size. The packed
+# buffer is itself the prefetched data, so the bodies are fetched one at a time
+# rather than with datasource.prefetch_all(), which would hold a second copy.
+def build_all_packets(magic, stride):
+    total = getattr(datasource, "numPackets", None)
+    if total is None:
+        return None
+    packets = bytearray(total * stride)
+    for i in range(total):
+        body = datasource.wait_for_data(i)
+        if body is None or HDR.size + len(body) != stride:
+            return None
+        HDR.pack_into(packets, i * stride, magic, i)
+        packets[i*stride + HDR.size : (i+1)*stride] = body
+    return memoryview(packets)
+
+
+# Write the congestion window log to cwndfile. This is registered to run at exit,
+# so the log gets saved even if the client is stopped early with Control-C.
+def save_cwnd_log(cwnd_log):
+    with open(cwndfile, "w") as f:
+        f.write("#Log of congestion window after each ACK received by client\n")
+        f.write("#Time,cwnd\n")
+        for i in range(0, len(cwnd_log), 2):
+            f.write("%f,%d\n" % (cwnd_log[i] * 1e-9, cwnd_log[i+1]))
+    print("**** Congestion window saved to %s ****" % (cwndfile))
+
+
 def main(host, port, n, t):
     print("Sending UDP packets to %s:%d using ssthres=%d and default timeout T=%f seconds" % (host, port, n, t))
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # Makes a UDP socket!
+    s.connect((host, port)) # all our packets go to the server, so connect to it
+    sendbatch.set_socket_buffers(s, sockbuf_size)
     
     trace.init(tracefile,
             "Log of all packets sent and ACKs received by client", 
             "SeqNo", "TimeSent", "AckNo", "timeACKed")
 
-    start = time.time()
+    magic = 0xBAADCAFE # a value to be included in every data packet
+    stride = HDR.size + datasource.packetSize # size of every full-sized packet
+    packets = None # all the packets, if they were built up front
+    if precompute:
+        print("Building all packets...")
+        packets = build_all_packets(magic, stride)
+        if packets is None:
+            print("... can't build packets up front, will make them as we go.")
+        else:
+            total_packets = len(packets) // stride
+            print("... %d packets are ready." % (total_packets))
+
+    start = time.monotonic_ns() # all times are integer nanoseconds from here
 
     timeout = t
     estimated_rtt = t
     dev_rtt = 0
-    send_times = {}
-    cwnd = 1
+    send_times = array.array('q') # send_times[i] is when seqno i was last sent
+    cwnd = 1 # congestion window, in packets (always an integer)
+    ca_count = 0 # ACKs received since cwnd last grew in congestion avoidance
     ssthresh = n
-    magic = 0xBAADCAFE # a value to be included in every data packet
+    cwnd_log = array.array('q') # (time in ns since start, cwnd) after each good ACK
+    if cwndfile is not None:
+        atexit.register(save_cwnd_log, cwnd_log)
     seqno = 0 # sequence number for the next data packet to be sent
-    desired_ackno = 0 # ACK number that we must next wait for
-    hdr = None # header for the next data packet to be sent
+    desired_ackno = 0 # ACK number that we must next wait for (oldest unacked seqno)
+    sendbuf = bytearray(stride) # reused for every packet, if not built up front
+    sendview = memoryview(sendbuf)
     body = None # data to be sent in the next data packet to be sent
     have_more_data = True # keep track of whether we have more data to send
-    outstanding = { } # a dictionary containing outstanding packets
+    # outstanding[i] holds the packet with seqno desired_ackno+i, or None if
+    # that packet has already been ACKed. The oldest entry is never None.
+    outstanding = collections.deque()
+    num_outstanding = 0 # number of packets in outstanding that are not None
     state = 0 # the current state for our protocol
 
+    # the selector tells us when an ACK is waiting to be received
+    sel = selectors.DefaultSelector()
+    sel.register(s, selectors.EVENT_READ)
+
+    # look up these methods once, rather than on every trip through the loop
+    send = s.send
+    recv = s.recv
+    select = sel.select
+    unpack_hdr = HDR.unpack_from
+    send_times_append = send_times.append
+    cwnd_log_append = cwnd_log.append
+    now = time.monotonic_ns
+    wait_for_data = datasource.wait_for_data
+    trace_write = trace.write
+    pack_hdr = HDR.pack_into
+    hdrsize = HDR.size
+
     # keep going if there more data OR some data is not yet acknowledged
-    while have_more_data or len(outstanding) > 0:
+    while have_more_data or outstanding:
         if state == 0: #  wait for data to be available to send
-            body = datasource.wait_for_data(seqno)
-            if body == None:
+            if packets is not None:
+                have_data = seqno < total_packets
+            else:
+                body = wait_for_data(seqno)
+                have_data = body is not None
+            if not have_data:
                 have_more_data = False
                 state = 2 # no more data, so now just wait for ACKs
             else:
                 state = 1 # go to state 1, to send the next packet
         
         elif state == 1: # send one data packet
-            # make a header, create a packet, and send it
-            hdr = bytearray(struct.pack(">II", magic, seqno))
-            pkt = hdr + body
-            tSend = time.time()
-            send_times[seqno] = tSend
-            s.sendto(pkt, (host, port))
+            if packets is not None:
+                # the packet is already built, so just send it
+                pkt = packets[seqno*stride : (seqno+1)*stride]
+            else:
+                # fill in the header and body of the send buffer, then send it
+                pack_hdr(sendbuf, 0, magic, seqno)
+                pktlen = hdrsize + len(body)
+                sendview[hdrsize:pktlen] = body
+                pkt = sendview[:pktlen]
+            tSend = now()
+            send_times_append(tSend)
+            try:
+                send(pkt)
+            except ConnectionRefusedError:
+                pass # the server isn't listening (yet), so the packet is lost
 
             # print stuff
-            if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0):
+            if verbose and (verbose >= 3 or seqno < 5 or seqno % 1000 == 0):
                 # print("Sent packet with seqno %d" % (seqno))
                 pass
 
             # write info about the packet (but without the ACK) to the log file
-            trace.write(seqno, tSend - start, 0, 0)
+            trace_write(seqno, (tSend - start) * 1e-9, 0, 0)
 
-            # record this packet in the outstanding set
-            outstanding[seqno] = pkt
+            # record this packet in the outstanding set, making a copy if it is
+            # in the send buffer, since that gets overwritten by the next packet
+            if packets is None:
+                pkt = bytes(pkt)
+            outstanding.append(pkt)
+            num_outstanding += 1
 
             # prepare for the next packet
             seqno += 1
 
-            if len(outstanding) >= cwnd: state = 2 # go to state 2
+            if num_outstanding >= cwnd: state = 2 # go to state 2
             else: state = 0 # go back to state 0
 
         elif state == 2: # Wait for the desired ACK
-
-            s.settimeout(timeout)
             try:
-                (ack, _) = s.recvfrom(100)
+                try:
+                    # If an ACK is already waiting, just take it. That is one
+                    # system call instead of two, and when the window is full
+                    # of packets it is usually the case.
+                    ack = recv(100, socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    # Otherwise wait for one. The deadline is measured from when
+                    # desired_ackno was last sent, so receiving the wrong ACK
+                    # doesn't restart the full timeout.
+                    remaining = timeout - (now() - send_times[desired_ackno]) * 1e-9
+                    if remaining <= 0 or not select(remaining):
+                        raise socket.timeout()
+                    ack = recv(100, socket.MSG_DONTWAIT)
                 
                 # unpack integers from the ACK packet, then print some messages
-                (_, ackno) = struct.unpack(">II", ack)
+                (_, ackno) = unpack_hdr(ack)
 
                 # recalculate timeout
-                tRecv = time.time()
-                sample_rtt = tRecv - send_times[ackno]
+                tRecv = now()
+                sample_rtt = (tRecv - send_times[ackno]) * 1e-9
                 estimated_rtt = estimated_rtt_calc(sample_rtt, estimated_rtt)
                 dev_rtt = dev_rtt_calc(sample_rtt, estimated_rtt, dev_rtt)
                 timeout = estimated_rtt + 4 * dev_rtt
                 # print(f"packet {ackno} had rtt {sample_rtt}, updated timeout to {timeout}")
 
-                if verbose >= 3 or (verbose >= 1 and seqno < 5 or seqno % 1000 == 0 or ackno != desired_ackno):
+                if verbose and (verbose >= 3 or seqno < 5 or seqno % 1000 == 0 or ackno != desired_ackno):
                     # print("Got ack with seqno %d while waiting for %d" % (ackno, desired_ackno))
                     pass
                 # write info about the ACK to the log file
-                trace.write(0, 0, ackno, tRecv - start)
+                trace_write(0, 0, ackno, (tRecv - start) * 1e-9)
 
-                if ackno in outstanding.keys(): del(outstanding[ackno])
+                i = ackno - desired_ackno
+                if 0 <= i < len(outstanding) and outstanding[i] is not None:
+                    outstanding[i] = None
+                    num_outstanding -= 1
+                    # drop acknowledged packets from the front of the window
+                    while outstanding and outstanding[0] is None:
+                        outstanding.popleft()
+                        desired_ackno += 1
 
-                if ackno == desired_ackno:
+                if i == 0:
                     # hurray, we got the ack we wanted
                     # print()
                 
-                    desired_ackno = next(iter(outstanding), seqno)
                     # print(f"New desired ackno is {desired_ackno}")
                     # print()
 
                     if cwnd < ssthresh:
                         cwnd += 1
                     else:
-                        cwnd += 1 / cwnd
+                        # grow by 1 packet per cwnd ACKs, i.e. cwnd += 1/cwnd
+                        ca_count += 1
+                        if ca_count >= cwnd:
+                            cwnd += 1
+                            ca_count = 0
                     state = 0
 
-                    print(f"{cwnd}, {time.time() - start}")
-                elif len(outstanding) >= cwnd:
+                    # remember the new cwnd, to be written to cwndfile at exit
+                    cwnd_log_append(tRecv - start)
+                    cwnd_log_append(cwnd)
+                elif num_outstanding >= cwnd:
                     state = 2
                 else:
                     # oops, got the wrong ack
                     state = 0
+            except BlockingIOError:
+                # the selector woke us up, but there was no ACK after all
+                state = 2
+            except ConnectionRefusedError:
+                # an ICMP "port unreachable" for something we sent earlier, so
+                # the server isn't listening (yet). That's not an ACK, and not
+                # a timeout either, so keep waiting until the same deadline.
+                state = 2
             except (socket.timeout, socket.error):
                 # print(f"Timeout, ACK {desired_ackno} didn't arrive quick enough!")
-                ssthresh = cwnd // 2
+                ssthresh = max(2, cwnd // 2)
                 cwnd = 1
+                ca_count = 0
                 timeout *= 2
                 state = 3
 
         elif state == 3: # Resend all outstanding packets.
             # Do we care what order we resend the packets? Maybe? Think about it.
-            # If we like, we could loop over the dictionary like this:
-            #    for resend_seqno, resend_pkt in outstanding.items(): ...
-            # and the packets would be sent in sorted order, because python3.7
-            # and above keeps items in a dictionary in the same order they were
-            # added to the dictionary.
+            # The outstanding packets are kept in seqno order, from desired_ackno
+            # up to (but not including) seqno, with None in place of any that
+            # were already ACKed. So we could loop over them like this:
+            #    for i, resend_pkt in enumerate(outstanding): ...
             #
-            # Here, we also know that the outstanding packets are exactly those
-            # from desired_ackno, up to (but not including) seqno. So we can
-            # loop over that range...
+            # Here, we just resend the oldest one, desired_ackno.
             # print()
             # print(f"desired ackno {desired_ackno}")
-            # print(f"outstanding {outstanding.keys()}")
+            # print(f"outstanding {list(outstanding)}")
             # print()
-            pkt = outstanding[desired_ackno]
-            tSend = time.time()
+            pkt = outstanding[0]
+            tSend = now()
             send_times[desired_ackno] = tSend
-            s.sendto(pkt, (host, port))
+            try:
+                send(pkt)
+            except ConnectionRefusedError:
+                pass # the server isn't listening (yet), so the packet is lost
             # print stuff and record in trace file
             if verbose >= 2:
                 # print("Re-sent packet with seqno %d" % (desired_ackno))
                 pass
-            trace.write(seqno, tSend - start, 0, 0)
+            trace_write(seqno, (tSend - start) * 1e-9, 0, 0)
             state = 2
 
         else:
             # print(f"OOPS! Should never be in state {state}")
             break
 
-    end = time.time()
-    elapsed = end - start
+    sel.close()
+
+    end = time.monotonic_ns()
+    elapsed = (end - start) * 1e-9
     print("Finished sending all packets!")
     print("Elapsed time: %0.4f s" % (elapsed))
     trace.close()
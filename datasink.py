@@ -184,7 +184,7 @@ def handle_websocket_connection(ws):
     ws.sendMessage("welcome")
     while True:
         (arrivalTime, seqno, payload) = recentPackets.get(True)
-        hdr = bytearray(struct.pack(">QI", arrivalTime, seqno))
+        hdr = struct.pack(">QI", arrivalTime, seqno)
         try:
             body = datasource.wait_for_data(seqno, True)
             if body == payload:
@@ -25,6 +25,7 @@ height = 360
 numFrames = 500
 
 numPackets = numFrames * height # 180000
+packetSize = width * 3 # 1440 bytes of payload in every packet
 
 # This function returns example payload data for a given sequence number.
 def wait_for_data(seqno, quiet=False):
@@ -45,6 +46,14 @@ def wait_for_data(seqno, quiet=False):
     else:
         return get_image_packet(img0, y)
 
+# This function returns a list with the payload data for every sequence number,
+# so bodies[seqno] is the same as wait_for_data(seqno). Building the list takes
+# a while and about 260 MB of memory, but afterwards the data for any packet is
+# just a list lookup away. A source that can't hold all its data at once (e.g.
+# a live stream) would return None here instead.
+def prefetch_all():
+    return [wait_for_data(seqno, True) for seqno in range(numPackets)]
+
 # If the program is ever killed using Control-C, save the trace before quitting.
 def signal_handler(signal, frame):
     print("Exiting...")
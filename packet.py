@@ -0,0 +1,11 @@
+# Author: C. Rotondo <ceroto25@g.holycross.edu>
+# Date: 8 November 2024
+#
+# The packet header shared by the clients and the server. Every data packet and
+# every ACK starts with two 4-byte big-endian integers: a "magic" number followed
+# by the sequence number. The format is compiled once here, so we don't
+# re-parse ">II" every time we pack or unpack a header.
+
+import struct
+
+HDR = struct.Struct(">II")
@@ -0,0 +1,221 @@
+# Author: C. Rotondo <ceroto25@g.holycross.edu>
+# Date: 8 November 2024
+#
+# Sends a batch of UDP packets with as few system calls as possible, instead of
+# making one sendto() call per packet. When every packet in the batch has the
+# same size, a UDP_SEGMENT (GSO) send hands the kernel up to 64 packets at once,
+# which it splits into separate datagrams. Otherwise the batch goes out with a
+# single sendmmsg() system call. Both only exist on Linux, so on other systems
+# (or if the kernel doesn't support them) this falls back to calling sendto()
+# once per packet.
+#
+# All the packets in a batch live in one contiguous bytearray, with packet i
+# starting at byte i*stride. To use it, fill in the packets (e.g. with
+# HDR.pack_into), record each packet's length with set_length(i, length), then
+# call send(count) to send packets 0 through count-1. If addr is None, the socket
+# must already be connected to the destination.
+#
+# On a connected socket, an ICMP "port unreachable" for an earlier packet gets
+# reported as ECONNREFUSED by a later send, without sending anything. That just
+# means the server isn't listening (yet), so in that case we try again.
+#
+# set_socket_buffers() sizes a socket's kernel buffers, so a whole batch (and
+# the ACKs that come back for it) fits without being dropped.
+
+import ctypes
+import errno
+import os
+import socket
+import struct
+import sys
+
+# UDP generic segmentation offload (GSO), from <linux/udp.h>. A single send can
+# carry several packets back-to-back, all the same size (except the last, which
+# may be shorter), and the kernel splits them into separate UDP datagrams.
+UDP_SEGMENT = 103
+UDP_MAX_SEGMENTS = 64
+
+# The path MTU of a connected socket, from <linux/in.h>. Each GSO segment must fit
+# in one IP packet (20 bytes of IP header, 8 bytes of UDP header, and the
+# payload), because the kernel won't fragment them like it does a plain send.
+IP_MTU = 14
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+# Look up sendmmsg() in the C library, if we are on Linux.
+sendmmsg = None
+if sys.platform.startswith("linux"):
+    try:
+        sendmmsg = ctypes.CDLL(None, use_errno=True).sendmmsg
+        sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        sendmmsg = None
+
+# Ask the kernel for send and receive buffers of the given size (in bytes) for
+# socket s, so bursts of packets (or ACKs) don't get dropped while waiting to be
+# processed. Prints a warning if we got less than we asked for. Linux caps the
+# size at /proc/sys/net/core/{w,r}mem_max, and getsockopt() reports double the
+# size actually set aside, to leave room for its own bookkeeping.
+def set_socket_buffers(s, size):
+    expected = 2 * size if sys.platform.startswith("linux") else size
+    for (opt, name) in ((socket.SO_SNDBUF, "wmem_max"), (socket.SO_RCVBUF, "rmem_max")):
+        s.setsockopt(socket.SOL_SOCKET, opt, size)
+        got = s.getsockopt(socket.SOL_SOCKET, opt)
+        if got < expected:
+            print("Warning: socket buffer is only %d bytes, not %d (see /proc/sys/net/core/%s)" %
+                    (got * size // expected, size, name))
+
+class SendBatch:
+
+    def __init__(self, sock, addr, count, stride):
+        self.sock = sock
+        self.addr = addr
+        self.count = count
+        self.stride = stride
+        self.buf = bytearray(count * stride)
+        self.view = memoryview(self.buf)
+        self.lengths = [stride] * count
+        self.use_sendmmsg = sendmmsg is not None and sock.family == socket.AF_INET
+        if self.use_sendmmsg:
+            self._setup_sendmmsg()
+        self.use_gso = False
+        self._setup_gso()
+
+    def _setup_gso(self):
+        # each send can carry at most UDP_MAX_SEGMENTS packets, and at most the
+        # 65507 bytes that fit in one (unsegmented) UDP datagram
+        self.gso_max_segments = min(UDP_MAX_SEGMENTS, 65507 // self.stride)
+        if not sys.platform.startswith("linux") or self.gso_max_segments < 2:
+            return
+        # if we know the path MTU (only for a connected socket), don't bother
+        # when each packet would need to be fragmented
+        if self.addr is None:
+            try:
+                if self.stride + 28 > self.sock.getsockopt(socket.IPPROTO_IP, IP_MTU):
+                    return
+            except OSError:
+                pass
+        # probe whether this kernel supports UDP_SEGMENT at all, then turn it
+        # back off, since otherwise it applies to every send on the socket (each
+        # GSO send gives its segment size in the ancillary data instead)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_UDP, UDP_SEGMENT, self.stride)
+            self.sock.setsockopt(socket.IPPROTO_UDP, UDP_SEGMENT, 0)
+        except OSError:
+            return
+        self._gso_size = struct.pack("=H", self.stride)
+        self.use_gso = True
+
+    def _setup_sendmmsg(self):
+        # a sockaddr_in for the destination, shared by every message
+        # (or no address at all, if the socket is connected)
+        self._name = None
+        if self.addr is not None:
+            (host, port) = self.addr
+            self._name = ctypes.create_string_buffer(
+                    struct.pack("=H", socket.AF_INET) + struct.pack(">H", port) +
+                    socket.inet_aton(socket.gethostbyname(host)) + bytes(8))
+        # one iovec and one mmsghdr per packet, each pointing into self.buf
+        self._cbuf = (ctypes.c_char * len(self.buf)).from_buffer(self.buf)
+        base = ctypes.addressof(self._cbuf)
+        self._iovs = (iovec * self.count)()
+        self._msgs = (mmsghdr * self.count)()
+        for i in range(self.count):
+            self._iovs[i].iov_base = base + i * self.stride
+            self._iovs[i].iov_len = self.stride
+            hdr = self._msgs[i].msg_hdr
+            if self._name is not None:
+                hdr.msg_name = ctypes.addressof(self._name)
+                hdr.msg_namelen = len(self._name) - 1
+            hdr.msg_iov = ctypes.pointer(self._iovs[i])
+            hdr.msg_iovlen = 1
+
+    def set_length(self, i, length):
+        self.lengths[i] = length
+        if self.use_sendmmsg:
+            self._iovs[i].iov_len = length
+
+    def send(self, count):
+        sent = 0
+        if self.use_gso and self.lengths[:count-1].count(self.stride) == count - 1:
+            sent = self._send_gso(count)
+        if sent < count and self.use_sendmmsg:
+            sent = self._send_sendmmsg(sent, count)
+        stride = self.stride
+        for i in range(sent, count):
+            self._send_one(self.view[i*stride : i*stride + self.lengths[i]])
+
+    def _send_one(self, pkt):
+        while True:
+            try:
+                if self.addr is None:
+                    self.sock.send(pkt)
+                else:
+                    self.sock.sendto(pkt, self.addr)
+                return
+            except ConnectionRefusedError:
+                pass
+
+    # Send packets 0 through count-1 as a few large UDP_SEGMENT sends, which the
+    # kernel splits back into one datagram per packet. This only works because
+    # every packet except the last is exactly stride bytes long. Returns how many
+    # packets were sent, which is less than count if GSO turned out not to work
+    # (e.g. EMSGSIZE, if a segment doesn't fit in the MTU of the path).
+    def _send_gso(self, count):
+        stride = self.stride
+        ancdata = [(socket.IPPROTO_UDP, UDP_SEGMENT, self._gso_size)]
+        dest = () if self.addr is None else (self.addr,)
+        sent = 0
+        while sent < count:
+            end = min(count, sent + self.gso_max_segments)
+            nbytes = (end - 1 - sent) * stride + self.lengths[end - 1]
+            try:
+                self.sock.sendmsg([self.view[sent*stride : sent*stride + nbytes]], ancdata, 0, *dest)
+            except ConnectionRefusedError:
+                continue
+            except OSError as e:
+                if e.errno not in (errno.EIO, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOPROTOOPT, errno.EMSGSIZE):
+                    raise
+                self.use_gso = False
+                break
+            sent = end
+        return sent
+
+    # Send packets first through count-1 with as few sendmmsg() calls as
+    # possible. Returns how many packets were sent, which is less than count if
+    # the kernel turned out not to support sendmmsg().
+    def _send_sendmmsg(self, first, count):
+        fd = self.sock.fileno()
+        msgs = ctypes.addressof(self._msgs)
+        size = ctypes.sizeof(mmsghdr)
+        sent = first
+        while sent < count:
+            # sendmmsg may send fewer than we asked, so keep going from there
+            r = sendmmsg(fd, msgs + sent * size, count - sent, 0)
+            if r >= 0:
+                sent += r
+                continue
+            e = ctypes.get_errno()
+            if e == errno.EINTR or e == errno.ECONNREFUSED:
+                continue
+            if e == errno.ENOSYS:
+                self.use_sendmmsg = False
+                break
+            raise OSError(e, os.strerror(e))
+        return sent
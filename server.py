@@ -23,9 +23,9 @@
 import socket
 import sys
 import time
-import struct
 import datasink
 import trace
+from packet import HDR
 
 # setting verbose = 0 turns off most printing
 # setting verbose = 1 turns on a little bit of printing
@@ -60,7 +60,7 @@ def main(host, port):
         payload = packet[8:]
 
         # unpack integers from the header
-        (magic, seqno) = struct.unpack(">II", hdr)
+        (magic, seqno) = HDR.unpack(hdr)
 
         # give the packet to the consumer
         numTimesSeen = datasink.deliver(seqno, payload)
@@ -76,7 +76,7 @@ def main(host, port):
         # create and send an ACK
         if verbose >= 2:
             print("  sending ACK in reply containing seqno = %d" % (seqno))
-        ack = bytearray(struct.pack(">II", 0xAAAAAAAA, seqno))
+        ack = HDR.pack(0xAAAAAAAA, seqno)
         s.sendto(ack, client_addr)
 
 
@@ -8,30 +8,58 @@
 # The first line is a title.
 # The second line is the title for each column.
 # The rest of the lines contain the data.
+#
+# To keep file I/O out of the time-critical send and receive loops, write() just
+# puts each row into a queue. A separate writer thread formats the rows and
+# writes them to the file. close() is also registered to run at exit, so rows
+# that are still queued get written even if the program ends some other way
+# (an uncaught exception, a sys.exit() call, etc.).
+
+import atexit
+import queue
+import threading
 
 csv = None
 csvname = None
+rows = None
+writer = None
 
 def init(filename, title, *args):
-    global csv, csvname
+    global csv, csvname, rows, writer
     if filename is not None:
         csv = open(filename, "w")
         csv.write("#" + title + "\n")
         csv.write("#" + (",".join(args)) + "\n")
         csvname = filename
+        rows = queue.SimpleQueue()
+        writer = threading.Thread(target=drain, args=(csv, rows))
+        writer.daemon = True
+        writer.start()
+        atexit.register(close)
         print("**** Data will be saved to %s ****" % (csvname))
 
+# The writer thread runs this, until it gets None from the queue.
+def drain(f, q):
+    while True:
+        args = q.get()
+        if args is None:
+            break
+        f.write(",".join([str(a) for a in args]) + "\n")
+
 def write(*args):
-    global csv
     if csv is not None:
-        csv.write(",".join([str(a) for a in args]) + "\n")
+        rows.put_nowait(args)
 
 def close():
-    global csv, csvname
+    global csv, csvname, rows, writer
     if csv is not None:
+        rows.put(None)
+        writer.join()
         csv.close()
         csv = None
+        rows = None
+        writer = None
+        atexit.unregister(close)
         print("**** Data saved to %s ****" % (csvname))
     else:
         print("**** No data saved, because tracefile = None ****")
-